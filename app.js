@@ -3,6 +3,8 @@ const express = require('express');
 const axios = require('axios');
 const cors = require('cors');
 const path = require('path');
+const https = require('https');
+const zlib = require('zlib');
 
 const app = express();
 app.use(cors());
@@ -19,6 +21,40 @@ try {
 const PLASMA_URL = 'https://services.swpc.noaa.gov/products/solar-wind/plasma-1-day.json';
 const MAG_URL    = 'https://services.swpc.noaa.gov/products/solar-wind/mag-1-day.json';
 
+// One long-lived HTTP client so each poll reuses the NOAA TLS connections
+const noaaHttp = axios.create({
+  timeout: 20_000,
+  httpsAgent: new https.Agent({ keepAlive: true, maxSockets: 4 })
+});
+
+// Conditional GET: resend NOAA's validators and reuse the previous body on 304 Not Modified
+const noaaCache = new Map(); // url -> { etag, lastModified, data }
+async function getNoaa(url) {
+  const prev = noaaCache.get(url);
+  const headers = {};
+  if (prev?.etag) headers['If-None-Match'] = prev.etag;
+  if (prev?.lastModified) headers['If-Modified-Since'] = prev.lastModified;
+  const res = await noaaHttp.get(url, { headers, validateStatus: s => (s >= 200 && s < 300) || (s === 304 && !!prev) });
+  if (res.status === 304) return prev.data;
+  // only a well-formed product is worth revalidating; a bad body must not be replayed on 304
+  if (Array.isArray(res.data)) noaaCache.set(url, { etag: res.headers.etag, lastModified: res.headers['last-modified'], data: res.data });
+  else noaaCache.delete(url);
+  return res.data;
+}
+
+// gzip JSON bodies above GZIP_MIN_BYTES when the client accepts it (sample arrays compress ~5-10x)
+const GZIP_MIN_BYTES = 1024;
+function sendJson(req, res, json) {
+  res.type('json');
+  res.vary('Accept-Encoding');
+  if (json.length < GZIP_MIN_BYTES || !req.acceptsEncodings('gzip')) return res.send(json);
+  zlib.gzip(json, (err, buf) => {
+    if (err) return res.send(json);
+    res.set('Content-Encoding', 'gzip');
+    res.send(buf);
+  });
+}
+
 // Config thresholds
 const POLL_INTERVAL_MS = 60 * 1000; 
 const BUFFER_MAX = 3000;            
@@ -26,6 +62,8 @@ const DELTA_WINDOW = 30;
 const BZ_INTEGRAL_WINDOW = 60;      // samples to integrate Bz over (~minutes)
 const FORECAST_STEPS = 6;           // how many steps to forecast (simple EWMA)
 const EWMA_ALPHA = 0.25;            // smoothing factor for EWMA forecasts
+const ANOMALY_WINDOW = 60;          // prior samples used for the z-score baseline
+const ANOMALY_MIN_SAMPLES = 8;      // minimum non-null samples before a z-score is trusted
 const THRESHOLDS = {
   speed_high: 500,    
   density_high: 10,   
@@ -37,6 +75,10 @@ const THRESHOLDS = {
 let plasmaBuffer = [];
 let magBuffer = [];
 let detections = [];
+let scanFrom = 0; // first buffer index runDetection has not evaluated yet
+let lastMagTime = ''; // newest mag sample received (mag can lag plasma by a poll)
+let bufferVersion = 0; // bumped whenever pollNOAA appends or backfills samples
+let eventsJson = null; // serialized /events body, dropped whenever detections change
 
 // Helpers
 function safeNum(v) {
@@ -49,6 +91,19 @@ function plasmaRowToObj(row) {
 function magRowToObj(row) {
   return { timeISO: row[0], bx: safeNum(row[1]), by: safeNum(row[2]), bz: safeNum(row[3]) };
 }
+function rowsAfter(data, lastTime, toObj) {
+  // NOAA products are [header, ...rows] with the time tag first: skip the header and any
+  // already-buffered rows before converting, in one pass (no slice/map/filter copies)
+  // axios hands back the raw string when a body isn't valid JSON (truncated, HTML error page):
+  // refuse it so the poll is skipped instead of buffering one "sample" per character
+  if (!Array.isArray(data)) throw new Error('unexpected NOAA payload (not a JSON array)');
+  const out = [];
+  for (let i = 1; i < data.length; i++) {
+    const row = data[i];
+    if (Array.isArray(row) && row[0] > lastTime) out.push(toObj(row));
+  }
+  return out;
+}
 function forecastArrivalHours(speed_km_s) {
   if (!speed_km_s || speed_km_s <= 0) return null;
   const AU_km = 149_597_870.7;
@@ -80,6 +135,13 @@ function computeBzIntegral(magBuf, idx, windowSamples){
   return Math.round(sum*100)/100; // nT-sample units (approx)
 }
 
+function numericField(rows, field){
+  // pull one non-null numeric series out of sample objects in a single pass (no map+filter temp)
+  const out = [];
+  for (let i=0;i<rows.length;i++){ const v = rows[i][field]; if (v != null) out.push(v); }
+  return out;
+}
+
 function simpleEwmaForecast(arr, alpha=EWMA_ALPHA, steps=FORECAST_STEPS){
   // arr: numeric array (most recent last) -> produce `steps` forecasts
   const out = [];
@@ -111,25 +173,24 @@ function computeScoreAndSeverity({speed, density, bz, deltaV}){
   return { score: Math.round(score*100)/100, severity_label, severity_class };
 }
 
+function windowZ(arr, field, idx){
+  // z-score of arr[idx][field] against the prior ANOMALY_WINDOW samples, single pass, no temp array
+  const cur = arr[idx]?.[field]; if (cur == null) return null;
+  let count = 0, sum = 0, sumSq = 0;
+  for (let i=Math.max(0, idx-ANOMALY_WINDOW);i<idx;i++){ const v = arr[i]?.[field]; if (v != null) { count++; sum += v; sumSq += v*v; } }
+  if (count < ANOMALY_MIN_SAMPLES) return null;
+  const mean = sum/count;
+  const sd = Math.sqrt(Math.max(0, sumSq/count - mean*mean)) || 0.00001;
+  const z = (cur - mean)/sd;
+  return {z, mean, sd, cur};
+}
+
 function detectAnomalyAt(bufs, idx){
   // simple z-score based anomaly: compute mean/std over prior window and check current
-  const WIN = 60; // use last 60 samples
-  const s = Math.max(0, idx-WIN);
   const out = { speed:false, bz:false, density:false, triggers: [] };
-  // helper
-  function zCheck(arr, field){
-    const vals = [];
-    for (let i=s;i<idx;i++){ const v = arr[i]?.[field]; if (v != null) vals.push(v); }
-    if (vals.length < 8) return null;
-    const mean = vals.reduce((a,b)=>a+b,0)/vals.length;
-    const sd = Math.sqrt(vals.reduce((a,b)=>a+((b-mean)**2),0)/vals.length) || 0.00001;
-    const cur = arr[idx]?.[field]; if (cur == null) return null;
-    const z = (cur - mean)/sd;
-    return {z, mean, sd, cur};
-  }
-  const zSpeed = zCheck(bufs.plasma, 'speed'); if (zSpeed && Math.abs(zSpeed.z) > 3){ out.speed=true; out.triggers.push({metric:'speed', z:Math.round(zSpeed.z*100)/100}); }
-  const zBz = zCheck(bufs.mag, 'bz'); if (zBz && Math.abs(zBz.z) > 3){ out.bz=true; out.triggers.push({metric:'bz', z:Math.round(zBz.z*100)/100}); }
-  const zD = zCheck(bufs.plasma, 'density'); if (zD && Math.abs(zD.z) > 3){ out.density=true; out.triggers.push({metric:'density', z:Math.round(zD.z*100)/100}); }
+  const zSpeed = windowZ(bufs.plasma, 'speed', idx); if (zSpeed && Math.abs(zSpeed.z) > 3){ out.speed=true; out.triggers.push({metric:'speed', z:Math.round(zSpeed.z*100)/100}); }
+  const zBz = windowZ(bufs.mag, 'bz', idx); if (zBz && Math.abs(zBz.z) > 3){ out.bz=true; out.triggers.push({metric:'bz', z:Math.round(zBz.z*100)/100}); }
+  const zD = windowZ(bufs.plasma, 'density', idx); if (zD && Math.abs(zD.z) > 3){ out.density=true; out.triggers.push({metric:'density', z:Math.round(zD.z*100)/100}); }
   out.isAnomaly = out.triggers.length > 0;
   return out;
 }
@@ -137,7 +198,11 @@ function detectAnomalyAt(bufs, idx){
 // Detector
 function runDetection() {
   const newDetections = [];
-  for (let i = 0; i < plasmaBuffer.length; i++) {
+  const seenIds = new Set(detections.map(d => d.id));
+  const bufs = { plasma: plasmaBuffer, mag: magBuffer }; // shared by every anomaly check in this run
+  // samples before scanFrom were already evaluated on an earlier run; if a late mag row fills
+  // an earlier placeholder, pollNOAA moves scanFrom back so those samples are re-evaluated
+  for (let i = scanFrom; i < plasmaBuffer.length; i++) {
     const p = plasmaBuffer[i];
     const m = magBuffer[i] || {};
     if (!p || !m) continue;
@@ -162,12 +227,13 @@ function runDetection() {
 
     if (isCME) {
       const id = `${p.timeISO}_${Math.round(speed)}`;
-      if (!detections.some(d => d.id === id) && !newDetections.some(d => d.id === id)) {
+      if (!seenIds.has(id)) {
+        seenIds.add(id);
         // compute derived features
         const pdyn = computePdyn(density, speed);
         const bz_integral = computeBzIntegral(magBuffer, i, BZ_INTEGRAL_WINDOW);
         const { score, severity_label, severity_class } = computeScoreAndSeverity({speed,density,bz,deltaV});
-        const anomaly = detectAnomalyAt({ plasma: plasmaBuffer, mag: magBuffer }, i);
+        const anomaly = detectAnomalyAt(bufs, i);
 
         newDetections.push({
           id,
@@ -188,10 +254,13 @@ function runDetection() {
       }
     }
   }
+  scanFrom = plasmaBuffer.length;
   if (newDetections.length) {
     detections = detections.concat(newDetections).slice(-100);
+    eventsJson = null;
     newDetections.forEach(d => {
-      console.log('🚨 CME DETECTED:', d);
+      // one compact line per event; dumping the whole object (nested anomaly triggers) is slow and noisy
+      console.log(`🚨 CME DETECTED: ${d.id} speed=${d.speed} density=${d.density} bz=${d.bz} severity=${d.severity_label}`);
       // persist to mongo if connected
       if (mongoDb) {
         try { mongoDb.collection('detections').updateOne({ id: d.id }, { $set: d }, { upsert: true }).catch(()=>{}); } catch(e) { /* ignore */ }
@@ -204,32 +273,64 @@ function runDetection() {
 // Poll NOAA
 async function pollNOAA() {
   try {
-    const [plasmaRes, magRes] = await Promise.all([
-      axios.get(PLASMA_URL, { timeout: 20_000 }),
-      axios.get(MAG_URL, { timeout: 20_000 })
+    const [plasmaData, magData] = await Promise.all([
+      getNoaa(PLASMA_URL),
+      getNoaa(MAG_URL)
     ]);
-    const plasmaRows = plasmaRes.data.slice(1).map(plasmaRowToObj);
-    const magRows = magRes.data.slice(1).map(magRowToObj);
+    // NOAA serves a rolling 1-day window that mostly overlaps the previous poll:
+    // keep only samples newer than what is already buffered (timestamps sort as strings).
+    // Plasma and mag are tracked separately because either product can lag the other.
+    const lastTime = plasmaBuffer.at(-1)?.timeISO || '';
+    const plasmaRows = rowsAfter(plasmaData, lastTime, plasmaRowToObj);
+    const magCandidates = rowsAfter(magData, lastTime < lastMagTime ? lastTime : lastMagTime, magRowToObj);
+    const magRows = magCandidates.filter(m => m.timeISO > lastMagTime); // not seen before: persist these
+    if (!plasmaRows.length && !magRows.length) return; // nothing new since last poll
+    if (magRows.length) lastMagTime = magRows.at(-1).timeISO;
+
+    // late mag rows for already-buffered minutes replace their {bz:null} placeholders
+    const lateMag = new Map();
+    for (const m of magRows) if (m.timeISO <= lastTime) lateMag.set(m.timeISO, m);
+    if (lateMag.size) {
+      const oldest = magRows[0].timeISO;
+      let firstFilled = -1;
+      for (let i = plasmaBuffer.length - 1; i >= 0 && plasmaBuffer[i].timeISO >= oldest; i--) {
+        const m = lateMag.get(plasmaBuffer[i].timeISO);
+        if (m) { magBuffer[i] = m; firstFilled = i; }
+      }
+      if (firstFilled >= 0) scanFrom = Math.min(scanFrom, firstFilled);
+    }
 
-    const magByTime = new Map(magRows.map(m => [m.timeISO, m]));
+    // join new plasma rows with any mag row past the plasma tail (including ones that arrived early)
+    const magByTime = new Map();
+    for (const m of magCandidates) if (m.timeISO > lastTime) magByTime.set(m.timeISO, m);
 
     for (const p of plasmaRows) {
       const m = magByTime.get(p.timeISO) || { bx: null, by: null, bz: null, timeISO: p.timeISO };
       plasmaBuffer.push(p);
       magBuffer.push(m);
-      if (plasmaBuffer.length > BUFFER_MAX) plasmaBuffer.shift();
-      if (magBuffer.length > BUFFER_MAX) magBuffer.shift();
     }
+    // trim once per poll: shift() per row re-indexes the whole buffer every time
+    if (plasmaBuffer.length > BUFFER_MAX) {
+      const dropped = plasmaBuffer.length - BUFFER_MAX;
+      plasmaBuffer.splice(0, dropped);
+      scanFrom = Math.max(0, scanFrom - dropped);
+    }
+    if (magBuffer.length > BUFFER_MAX) magBuffer.splice(0, magBuffer.length - BUFFER_MAX);
+    bufferVersion++;
+    // detect on the in-memory buffers right away; /events shouldn't wait on the Mongo round-trip
+    runDetection();
     // persist raw rows to mongo if available
     if (mongoDb) {
       try {
         const pOps = plasmaRows.map(r => ({ updateOne: { filter: { timeISO: r.timeISO }, update: { $set: r }, upsert: true } }));
         const mOps = magRows.map(r => ({ updateOne: { filter: { timeISO: r.timeISO }, update: { $set: r }, upsert: true } }));
-        if (pOps.length) await mongoDb.collection('plasma').bulkWrite(pOps, { ordered: false });
-        if (mOps.length) await mongoDb.collection('mag').bulkWrite(mOps, { ordered: false });
+        // the two collections are independent: write them concurrently
+        await Promise.all([
+          pOps.length ? mongoDb.collection('plasma').bulkWrite(pOps, { ordered: false }) : null,
+          mOps.length ? mongoDb.collection('mag').bulkWrite(mOps, { ordered: false }) : null
+        ]);
       } catch (e) { console.warn('mongo bulk upsert failed:', e.message || e); }
     }
-    runDetection();
   } catch (err) {
     console.error('Error polling NOAA:', err.message || err);
   }
@@ -251,26 +352,32 @@ app.get('/latest', (req, res) => {
   // include short EWMA forecasts for speed and bz
   const plasmaSlice = plasmaBuffer.slice(-n);
   const magSlice = magBuffer.slice(-n);
-  const speeds = plasmaSlice.map(p => p.speed).filter(v=>v!=null);
-  const bzs = magSlice.map(m => m.bz).filter(v=>v!=null);
+  const speeds = numericField(plasmaSlice, 'speed');
+  const bzs = numericField(magSlice, 'bz');
   const speed_forecast = simpleEwmaForecast(speeds);
   const bz_forecast = simpleEwmaForecast(bzs);
-  res.json({ 
+  sendJson(req, res, JSON.stringify({ 
     plasma: plasmaSlice, 
     mag: magSlice, 
     last_polled: plasmaBuffer.at(-1)?.timeISO || null,
     forecast: { speed: speed_forecast, bz: bz_forecast }
-  });
+  }));
+});
+app.get('/events', (req, res) => {
+  if (eventsJson == null) eventsJson = JSON.stringify({ detections });
+  sendJson(req, res, eventsJson);
 });
-app.get('/events', (req, res) => res.json({ detections }));
 
 // quick predict endpoint: returns short forecasts and a simple alert summary
+// last /predict body (already serialized): inputs only change when pollNOAA appends, so reuse it until then
+let predictCache = { version: -1, n: null, json: null };
 app.get('/predict', (req, res) => {
   const recent = Number(req.query.n) || 200;
+  if (predictCache.version === bufferVersion && predictCache.n === recent) return sendJson(req, res, predictCache.json);
   const plasmaSlice = plasmaBuffer.slice(-recent);
   const magSlice = magBuffer.slice(-recent);
-  const speeds = plasmaSlice.map(p => p.speed).filter(v=>v!=null);
-  const bzs = magSlice.map(m => m.bz).filter(v=>v!=null);
+  const speeds = numericField(plasmaSlice, 'speed');
+  const bzs = numericField(magSlice, 'bz');
   const speed_forecast = simpleEwmaForecast(speeds);
   const bz_forecast = simpleEwmaForecast(bzs);
 
@@ -281,38 +388,43 @@ app.get('/predict', (req, res) => {
   const { score, severity_label, severity_class } = computeScoreAndSeverity({ speed: lastP.speed, density: lastP.density, bz: lastM.bz, deltaV });
   const anomaly = detectAnomalyAt({ plasma: plasmaBuffer, mag: magBuffer }, plasmaBuffer.length-1);
 
-  res.json({
+  const json = JSON.stringify({
     forecast: { speed: speed_forecast, bz: bz_forecast },
     quick: { score, severity_label, severity_class, anomaly }
   });
+  predictCache = { version: bufferVersion, n: recent, json };
+  sendJson(req, res, json);
 });
 app.get('/cme-detect', (req, res) => res.json({ new: runDetection(), all: detections }));
 app.get('/health', (req, res) => res.json({ ok: true, plasma_samples: plasmaBuffer.length }));
 
+// helper to escape CSV values: one precompiled scan instead of four includes() per cell
+const CSV_SPECIAL = /[",\r\n]/;
+function csvEscape(v){
+  if (v == null) return '';
+  const s = String(v);
+  if (CSV_SPECIAL.test(s)) return '"' + s.replace(/"/g,'""') + '"';
+  return s;
+}
+
 // Export endpoint: /export?format=json|csv&limit=1000
 app.get('/export', async (req, res) => {
   const format = (req.query.format || 'json').toLowerCase();
   const limit = Math.min(50000, Number(req.query.limit) || 1000);
   // columns for CSV export
   const cols = ['id','timeISO','speed','density','bz','deltaV','pdyn','bz_integral','score','severity_label','severity_class','intensity','forecast_arrival_hours'];
-
-  // helper to escape CSV values
-  function csvEscape(v){
-    if (v == null) return '';
-    const s = String(v);
-    if (s.includes('"') || s.includes(',') || s.includes('\n') || s.includes('\r')) return '"' + s.replace(/"/g,'""') + '"';
-    return s;
-  }
+  // only fetch the fields each format actually emits
+  const csvProjection = Object.fromEntries([['_id', 0], ...cols.map(c => [c, 1])]);
 
   // JSON path: simple (small) response
   if (format === 'json') {
     let rows = [];
     if (mongoDb) {
-      try { rows = await mongoDb.collection('detections').find({}).sort({ timeISO: -1 }).limit(limit).toArray(); } catch(e){ console.warn('mongo export failed:', e.message || e); rows = []; }
+      try { rows = await mongoDb.collection('detections').find({}, { projection: { _id: 0 } }).sort({ timeISO: -1 }).limit(limit).toArray(); } catch(e){ console.warn('mongo export failed:', e.message || e); rows = []; }
     }
     if (!rows.length) rows = detections.slice(-limit);
     res.setHeader('Content-Disposition', 'attachment; filename="detections.json"');
-    return res.json(rows);
+    return sendJson(req, res, JSON.stringify(rows));
   }
 
   // CSV streaming path: stream cursor from MongoDB when available to avoid buffering large exports
@@ -325,15 +437,20 @@ app.get('/export', async (req, res) => {
 
   if (mongoDb) {
     try {
-      const cursor = mongoDb.collection('detections').find({}).sort({ timeISO: -1 }).limit(limit);
+      const cursor = mongoDb.collection('detections').find({}, { projection: csvProjection }).sort({ timeISO: -1 }).limit(limit);
       // handle client abort
       let aborted = false;
       req.on('close', () => { aborted = true; try { cursor.close(); } catch(e){} });
 
-      cursor.stream().on('data', doc => {
+      const stream = cursor.stream();
+      stream.on('data', doc => {
         try {
           const line = cols.map(c => csvEscape(doc[c])).join(',');
-          res.write(line + '\n');
+          // respect backpressure so a slow client doesn't buffer the whole export in memory
+          if (!res.write(line + '\n')) {
+            stream.pause();
+            res.once('drain', () => stream.resume());
+          }
         } catch (e) { /* ignore write errors per-row */ }
       }).on('end', () => {
         if (!aborted) res.end();
@@ -351,11 +468,10 @@ app.get('/export', async (req, res) => {
   // Fallback: stream from in-memory detections array
   try {
     const rows = detections.slice(-limit);
-    for (const r of rows) {
-      const line = cols.map(c => csvEscape(r[c])).join(',');
-      res.write(line + '\n');
-    }
-    res.end();
+    // at most 100 rows in memory: build one chunk and write it in a single call
+    let chunk = '';
+    for (const r of rows) chunk += cols.map(c => csvEscape(r[c])).join(',') + '\n';
+    res.end(chunk);
   } catch (e) {
     console.warn('export fallback failed:', e && e.message);
     try { res.end(); } catch(e){}
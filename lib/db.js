@@ -11,13 +11,15 @@ async function connect() {
   client = new MongoClient(MONGO_URL, { useNewUrlParser: true, useUnifiedTopology: true });
   await client.connect();
   db = client.db(DB_NAME);
-  // ensure indexes
+  // ensure indexes (independent, so build them concurrently instead of one round-trip at a time)
   try {
-    await db.collection('detections').createIndex({ timeISO: 1 });
-    await db.collection('detections').createIndex({ severity_class: 1 });
-  // indexes for time-series tables
-  await db.collection('plasma').createIndex({ timeISO: 1 }, { unique: true });
-  await db.collection('mag').createIndex({ timeISO: 1 }, { unique: true });
+    await Promise.all([
+      db.collection('detections').createIndex({ timeISO: 1 }),
+      db.collection('detections').createIndex({ severity_class: 1 }),
+      // indexes for time-series tables
+      db.collection('plasma').createIndex({ timeISO: 1 }, { unique: true }),
+      db.collection('mag').createIndex({ timeISO: 1 }, { unique: true })
+    ]);
   } catch (e) { /* ignore index errors */ }
   return db;
 }